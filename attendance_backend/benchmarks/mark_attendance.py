@@ -0,0 +1,110 @@
+"""Benchmark concurrent mark-entry/mark-exit throughput with and without batching.
+
+Usage: python benchmarks/mark_attendance.py [--workers 300] [--window-ms 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from src.models.directory import sync_login_index
+from src.models.tenant import run_in_tenant
+from src.models.user import User, db
+from src.routes.user import user_bp
+
+
+def make_app(db_dir, batching, window_ms):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'bench'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(db_dir, 'app.db')}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TENANT_DATABASE_URI'] = f"sqlite:///{os.path.join(db_dir, 'tenant_{tenant_id}.db')}"
+    app.config['ATTENDANCE_BATCHING'] = batching
+    app.config['ATTENDANCE_BATCH_WINDOW_MS'] = window_ms
+    app.register_blueprint(user_bp, url_prefix='/api')
+    db.init_app(app)
+    return app
+
+
+def run(batching, workers, window_ms):
+    with tempfile.TemporaryDirectory() as db_dir:
+        app = make_app(db_dir, batching, window_ms)
+        with app.app_context():
+            db.create_all()
+            admin = User(username='admin', role='admin')
+            admin.set_password('admin')
+            db.session.add(admin)
+            db.session.commit()
+            sync_login_index()
+
+        # Logging in provisions the admin's tenant database, as in production
+        admin_client = app.test_client()
+        tenant_id = admin_client.post('/api/login', json={'login': 'admin', 'password': 'admin'}).get_json()['user']['id']
+
+        def add_workers():
+            users = [
+                User(username=f'worker{i}', role='worker', password_hash='-',
+                     daily_wage=800.0, admin_id=tenant_id)
+                for i in range(workers)
+            ]
+            db.session.add_all(users)
+            db.session.commit()
+            return [u.id for u in users]
+
+        with app.app_context():
+            user_ids = run_in_tenant(tenant_id, add_workers)
+
+        clients = []
+        for user_id in user_ids:
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['tenant_id'] = tenant_id
+            clients.append(client)
+
+        failures = []
+
+        def mark(client, path):
+            response = client.post(path)
+            if response.status_code != 200:
+                failures.append(response.get_json())
+
+        elapsed = 0.0
+        for path in ('/api/attendance/mark-entry', '/api/attendance/mark-exit'):
+            barrier = threading.Barrier(workers + 1)
+
+            def worker(client):
+                barrier.wait()
+                mark(client, path)
+
+            threads = [threading.Thread(target=worker, args=(c,)) for c in clients]
+            for t in threads:
+                t.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for t in threads:
+                t.join()
+            elapsed += time.perf_counter() - start
+
+        return 2 * workers / elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=300)
+    parser.add_argument('--window-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    for batching in (False, True):
+        rate, failures = run(batching, args.workers, args.window_ms)
+        label = 'batched' if batching else 'unbatched'
+        print(f'{label:>10}: {rate:8.1f} marks/s ({len(failures)} failed)')
+
+
+if __name__ == '__main__':
+    main()
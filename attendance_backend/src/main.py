@@ -23,6 +23,15 @@ app.register_blueprint(user_bp, url_prefix='/api')
 # Database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Per-admin tenant databases; {tenant_id} is the admin's user id
+app.config['TENANT_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'tenants', 'tenant_{tenant_id}.db')}"
+app.config['TENANT_FANOUT_WORKERS'] = 8
+# Admin ids allowed to read /api/admin/sites/summary across all tenants
+app.config['REPORTING_ADMIN_IDS'] = []
+# Group-commit attendance marks arriving within a few milliseconds
+app.config['ATTENDANCE_BATCHING'] = True
+app.config['ATTENDANCE_BATCH_WINDOW_MS'] = 5
+app.config['ATTENDANCE_BATCH_MAX'] = 500
 db.init_app(app)
 
 # Create tables and add sample admin user
@@ -44,6 +53,12 @@ with app.app_context():
         db.session.add(admin)
         db.session.commit()
         print("Sample admin user created: username='admin', password='admin123'")
+    
+    # Index login identifiers of users created before the login index existed,
+    # and add the one-record-per-day index to databases that predate it
+    from src.models.directory import sync_login_index, prepare_attendance_tables
+    sync_login_index()
+    prepare_attendance_tables()
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
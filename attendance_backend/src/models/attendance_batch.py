@@ -0,0 +1,210 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import IntegrityError
+
+from src.models.tenant import current_tenant_id, run_in_tenant
+from src.models.user import User, AttendanceRecord, db
+
+# Group commit for attendance marks. At shift start many workers mark entry at
+# once; instead of one transaction (and one fsync) per request, the first
+# caller for a tenant waits a few milliseconds, then writes every mark that
+# queued up meanwhile in a single transaction. Within one process, batches for
+# a tenant run one after another and marks are applied in arrival order, so a
+# user's marks keep their order. The one-record-per-day rule is enforced by the
+# unique (user_id, date) index on AttendanceRecord; a mark that loses a race
+# against another process is re-applied against the committed record.
+
+
+class AttendanceMark:
+    def __init__(self, kind, user_id, when):
+        self.kind = kind  # 'entry' or 'exit'
+        self.user_id = user_id
+        self.when = when
+        self.record = None
+        self.error = None
+        self._exception = None
+        self._promoted = False
+        self._done = threading.Event()
+
+
+def write_marks(marks):
+    """Apply marks in order in the current db.session and commit once"""
+    try:
+        _apply_marks(marks)
+    except IntegrityError:
+        # Another writer created one of these records first; re-read and retry
+        db.session.rollback()
+        for mark in marks:
+            mark.record = mark.error = None
+        _apply_marks(marks)
+
+
+def _apply_marks(marks):
+    user_ids = {m.user_id for m in marks}
+    days = {m.when.date() for m in marks}
+
+    users = {u.id: u for u in User.query.filter(User.id.in_(user_ids)).all()}
+    records = {
+        (r.user_id, r.date): r
+        for r in AttendanceRecord.query.filter(
+            AttendanceRecord.user_id.in_(user_ids),
+            AttendanceRecord.date.in_(days)
+        ).all()
+    }
+
+    written = []
+    for mark in marks:
+        if mark.user_id not in users:
+            mark.error = 'User not found'
+            continue
+
+        key = (mark.user_id, mark.when.date())
+        record = records.get(key)
+
+        if mark.kind == 'entry':
+            if record and record.entry_time:
+                mark.error = 'Entry already marked for today'
+                continue
+            if not record:
+                record = AttendanceRecord(user=users[mark.user_id], date=key[1])
+                db.session.add(record)
+                records[key] = record
+            record.entry_time = mark.when
+        else:
+            if not record or not record.entry_time:
+                mark.error = 'Please mark entry first'
+                continue
+            if record.exit_time:
+                mark.error = 'Exit already marked for today'
+                continue
+            record.exit_time = mark.when
+            time_diff = record.exit_time - record.entry_time
+            record.total_hours = round(time_diff.total_seconds() / 3600, 2)
+            record.calculate_earnings()
+
+        written.append((mark, record))
+
+    # Serialize after the flush (ids and timestamps are set) but before the
+    # commit expires the records, so acknowledging costs no extra queries
+    db.session.flush()
+    for mark, record in written:
+        mark.record = record.to_dict()
+    db.session.commit()
+
+
+def merge_attendance(rows):
+    """Merge attendance rows for the same (user_id, date) into one row dict.
+
+    The most complete row wins (exit marked, then entry marked, then newest);
+    notes from the others are kept.
+    """
+    rows = sorted(rows, key=lambda r: (r['exit_time'] is not None, r['entry_time'] is not None, r['id']))
+    merged = dict(rows[-1])
+    notes = [r['notes'] for r in reversed(rows) if r['notes']]
+    merged['notes'] = '\n'.join(dict.fromkeys(notes)) or None
+    return merged
+
+
+def ensure_unique_attendance():
+    """Merge duplicate (user_id, date) rows in the current database and add the unique index"""
+    table = AttendanceRecord.__table__
+    duplicates = db.session.execute(
+        select(table.c.user_id, table.c.date)
+        .group_by(table.c.user_id, table.c.date)
+        .having(func.count() > 1)
+    ).all()
+
+    for user_id, day in duplicates:
+        rows = [dict(r) for r in db.session.execute(
+            table.select().where(table.c.user_id == user_id, table.c.date == day)
+        ).mappings()]
+        merged = merge_attendance(rows)
+        db.session.execute(table.delete().where(
+            table.c.id.in_([r['id'] for r in rows if r['id'] != merged['id']])))
+        db.session.execute(table.update().where(table.c.id == merged['id']).values(notes=merged['notes']))
+
+    db.session.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_user_date ON attendance_record (user_id, date)'))
+    db.session.commit()
+
+
+class AttendanceBatcher:
+    def __init__(self, window=0.005, max_batch=500):
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = {}  # tenant_id -> marks waiting for the next batch
+        self._leading = set()  # tenants with a batch being collected or written
+
+    def submit(self, tenant_id, mark):
+        with self._lock:
+            self._pending.setdefault(tenant_id, []).append(mark)
+            lead = tenant_id not in self._leading
+            self._leading.add(tenant_id)
+
+        if lead:
+            self._lead(tenant_id, self.window)
+        else:
+            mark._done.wait()
+            if mark._promoted:
+                # Marks piled up while the previous batch was written
+                self._lead(tenant_id, 0)
+
+        if mark._exception is not None:
+            raise mark._exception
+        return mark
+
+    def _lead(self, tenant_id, window):
+        if window:
+            time.sleep(window)
+
+        with self._lock:
+            pending = self._pending[tenant_id]
+            batch, self._pending[tenant_id] = pending[:self.max_batch], pending[self.max_batch:]
+
+        try:
+            try:
+                run_in_tenant(tenant_id, write_marks, batch)
+            except Exception:
+                # Write the marks one at a time so each caller only sees
+                # its own failure
+                for mark in batch:
+                    mark.record = mark.error = None
+                    try:
+                        run_in_tenant(tenant_id, write_marks, [mark])
+                    except Exception as e:
+                        mark._exception = e
+        finally:
+            with self._lock:
+                pending = self._pending[tenant_id]
+                if pending:
+                    pending[0]._promoted = True
+                    pending[0]._done.set()
+                else:
+                    del self._pending[tenant_id]
+                    self._leading.discard(tenant_id)
+
+            for mark in batch:
+                mark._done.set()
+
+
+def submit_mark(kind, user_id):
+    """Record an entry/exit mark for user_id now, batching writes if enabled"""
+    mark = AttendanceMark(kind, user_id, datetime.now())
+    app = current_app._get_current_object()
+
+    if not app.config.get('ATTENDANCE_BATCHING', False):
+        write_marks([mark])
+        return mark
+
+    batcher = app.extensions.get('attendance_batcher')
+    if batcher is None:
+        batcher = app.extensions.setdefault('attendance_batcher', AttendanceBatcher(
+            window=app.config.get('ATTENDANCE_BATCH_WINDOW_MS', 5) / 1000,
+            max_batch=app.config.get('ATTENDANCE_BATCH_MAX', 500)
+        ))
+    return batcher.submit(current_tenant_id(), mark)
@@ -0,0 +1,199 @@
+import threading
+
+from sqlalchemy.exc import IntegrityError
+
+from src.models.attendance_batch import merge_attendance, ensure_unique_attendance
+from src.models.tenant import run_in_tenant, fan_out
+from src.models.user import User, AttendanceRecord, ExtraPayment, WeeklyReport, LoginIndex, db
+
+# Directory-side bookkeeping for tenant sharding. Login identifiers are
+# claimed in the directory's LoginIndex, whose primary key keeps them unique
+# across every tenant, so login and duplicate checks never touch tenant
+# databases. Workers of admins who have not logged in since sharding was
+# enabled still live in the directory; provision_tenant() moves them.
+
+_provision_lock = threading.Lock()
+
+
+def tenant_ids():
+    return run_in_tenant(None, lambda: [a.id for a in User.query.filter_by(role='admin').all()])
+
+
+def login_identifiers(username, email, phone):
+    return list(dict.fromkeys(v for v in (username, email, phone) if v))
+
+
+def find_login(login):
+    """Return (tenant_id, user_id) for a login identifier, or None"""
+    def find():
+        entry = db.session.get(LoginIndex, login)
+        if entry and entry.user_id is not None:
+            return entry.tenant_id, entry.user_id
+        return None
+
+    return run_in_tenant(None, find) if login else None
+
+
+def reserve_logins(logins, tenant_id):
+    """Claim login identifiers for a user about to be created; False if any is taken"""
+    def reserve():
+        db.session.add_all([LoginIndex(login=login, tenant_id=tenant_id) for login in logins])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        return True
+
+    return run_in_tenant(None, reserve)
+
+
+def assign_logins(logins, tenant_id, user_id):
+    def assign():
+        LoginIndex.query.filter(LoginIndex.login.in_(logins)).update(
+            {'tenant_id': tenant_id, 'user_id': user_id}, synchronize_session=False)
+        db.session.commit()
+
+    run_in_tenant(None, assign)
+
+
+def release_logins(logins):
+    def release():
+        LoginIndex.query.filter(LoginIndex.login.in_(logins)).delete(synchronize_session=False)
+        db.session.commit()
+
+    if logins:
+        run_in_tenant(None, release)
+
+
+def sync_login_index():
+    """Index directory and tenant users missing from LoginIndex (run at startup)"""
+    def directory_users():
+        # Reservations whose user was never created
+        LoginIndex.query.filter(LoginIndex.user_id.is_(None)).delete(synchronize_session=False)
+        db.session.commit()
+        return [(u.id, login_identifiers(u.username, u.email, u.phone)) for u in User.query.all()]
+
+    def tenant_users():
+        return [(u.id, login_identifiers(u.username, u.email, u.phone))
+                for u in User.query.filter(User.role != 'admin').all()]
+
+    def index(found):
+        known = {e.login for e in LoginIndex.query.all()}
+        for tenant_id, users in found:
+            for user_id, logins in users:
+                for login in logins:
+                    if login not in known:
+                        db.session.add(LoginIndex(login=login, tenant_id=tenant_id, user_id=user_id))
+                        known.add(login)
+        db.session.commit()
+
+    found = [(None, run_in_tenant(None, directory_users))]
+    found += list(fan_out(tenant_ids(), tenant_users).items())
+    run_in_tenant(None, index, found)
+
+
+def prepare_attendance_tables():
+    """Merge duplicate attendance rows and add the unique index in every database (run at startup)"""
+    run_in_tenant(None, ensure_unique_attendance)
+    fan_out(tenant_ids(), ensure_unique_attendance)
+
+
+def _rows(model, *criteria):
+    return [dict(r) for r in db.session.execute(model.__table__.select().where(*criteria)).mappings()]
+
+
+def _copy_to_tenant(admin, workers, records):
+    # Rows are matched on natural keys rather than ids, so copying again after
+    # a failed move skips whatever already arrived
+    if db.session.get(User, admin['id']) is None:
+        db.session.execute(User.__table__.insert().values(**admin))
+
+    id_map = {}
+    for worker in workers:
+        existing = User.query.filter_by(username=worker['username']).first()
+        if existing:
+            id_map[worker['id']] = existing.id
+        else:
+            row = {k: v for k, v in worker.items() if k != 'id'}
+            result = db.session.execute(User.__table__.insert().values(**row))
+            id_map[worker['id']] = result.inserted_primary_key[0]
+
+    for model, key_columns, rows in records:
+        table = model.__table__
+        for row in rows:
+            row = {k: v for k, v in row.items() if k != 'id'}
+            row['user_id'] = id_map[row['user_id']]
+            criteria = [table.c[c] == row[c] for c in key_columns]
+            if db.session.execute(table.select().where(*criteria)).first() is None:
+                db.session.execute(table.insert().values(**row))
+
+    db.session.commit()
+    return id_map
+
+
+def _move_to_tenant(admin_id):
+    # Take the directory write lock first (SQLite locks on the first write of
+    # a transaction), so no directory mark or edit for these workers can land
+    # between reading their rows and deleting them
+    users = User.__table__
+    db.session.execute(users.update().where(users.c.id == admin_id).values(id=users.c.id))
+
+    admin = _rows(User, User.id == admin_id)[0]
+    workers = _rows(User, User.admin_id == admin_id, User.role == 'worker')
+    worker_ids = [w['id'] for w in workers]
+
+    # The directory may predate the unique index; copy one merged row per
+    # (user_id, date) but delete every original
+    attendance = _rows(AttendanceRecord, AttendanceRecord.user_id.in_(worker_ids))
+    days = {}
+    for row in attendance:
+        days.setdefault((row['user_id'], row['date']), []).append(row)
+
+    records = [
+        (AttendanceRecord, ('user_id', 'date'), [merge_attendance(rows) for rows in days.values()]),
+        (ExtraPayment, ('user_id', 'created_at'),
+         _rows(ExtraPayment, ExtraPayment.user_id.in_(worker_ids))),
+        (WeeklyReport, ('user_id', 'generated_at'),
+         _rows(WeeklyReport, WeeklyReport.user_id.in_(worker_ids)))
+    ]
+
+    id_map = run_in_tenant(admin_id, _copy_to_tenant, admin, workers, records)
+
+    # Point the workers' login identifiers at the tenant, then delete the
+    # directory copies; both commit together with the lock released last
+    for worker in workers:
+        logins = login_identifiers(worker['username'], worker['email'], worker['phone'])
+        LoginIndex.query.filter(
+            LoginIndex.tenant_id.is_(None),
+            LoginIndex.user_id == worker['id']
+        ).delete(synchronize_session=False)
+        taken = {e.login for e in LoginIndex.query.filter(LoginIndex.login.in_(logins)).all()}
+        db.session.add_all([
+            LoginIndex(login=login, tenant_id=admin_id, user_id=id_map[worker['id']])
+            for login in logins if login not in taken
+        ])
+
+    deleted = [(AttendanceRecord, attendance)] + [(model, rows) for model, _, rows in records[1:]]
+    for model, rows in deleted:
+        if rows:
+            db.session.execute(model.__table__.delete().where(model.id.in_([r['id'] for r in rows])))
+    if worker_ids:
+        db.session.execute(users.delete().where(users.c.id.in_(worker_ids)))
+    db.session.commit()
+
+
+def provision_tenant(admin_id):
+    """Copy the admin into its tenant database and move any of its workers
+    (with their attendance, payments and reports) still in the directory.
+
+    Safe to call on every admin login: it only does work when something is
+    left to move, and a move interrupted part-way is finished by the next call.
+    """
+    with _provision_lock:
+        provisioned = run_in_tenant(admin_id, lambda: db.session.get(User, admin_id) is not None)
+        leftover = run_in_tenant(
+            None, lambda: User.query.filter_by(admin_id=admin_id, role='worker').first() is not None)
+        if provisioned and not leftover:
+            return
+        run_in_tenant(None, _move_to_tenant, admin_id)
@@ -0,0 +1,92 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+
+# Each admin (tenant) keeps its workers, attendance, payments and reports in
+# its own database so that writes at one site never wait on another site's
+# lock. The main SQLALCHEMY_DATABASE_URI is the directory database: it holds
+# the admin accounts, plus workers (and their attendance, payments and
+# reports) of admins who have not logged in since sharding was enabled, and
+# the login index. Every admin login moves any such leftover data into the
+# admin's tenant database (see src/models/directory.py).
+
+_engine_lock = threading.Lock()
+
+
+def current_tenant_id():
+    """Return the tenant bound to the current app context, or None for the directory"""
+    if not has_app_context():
+        return None
+    return g.get('tenant_id')
+
+
+def get_tenant_engine(tenant_id):
+    """Return (creating on first use) the engine for a tenant's database"""
+    app = current_app._get_current_object()
+    engines = app.extensions.setdefault('tenant_engines', {})
+    engine = engines.get(tenant_id)
+    if engine is not None:
+        return engine
+
+    with _engine_lock:
+        engine = engines.get(tenant_id)
+        if engine is None:
+            url = sa.engine.make_url(app.config['TENANT_DATABASE_URI'].format(tenant_id=int(tenant_id)))
+            if url.get_backend_name() == 'sqlite' and url.database:
+                os.makedirs(os.path.dirname(url.database), exist_ok=True)
+            engine = sa.create_engine(url)
+            metadata = app.extensions['sqlalchemy'].metadata
+            tables = [t for t in metadata.sorted_tables if not t.info.get('directory')]
+            metadata.create_all(engine, tables=tables)
+            engines[tenant_id] = engine
+    return engine
+
+
+class TenantSession(Session):
+    """Session that routes every query to the database of the current tenant"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            tenant_id = current_tenant_id()
+            if tenant_id is not None:
+                return get_tenant_engine(tenant_id)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def run_in_tenant(tenant_id, fn, *args, **kwargs):
+    """Call fn inside a fresh app context bound to tenant_id (None = directory).
+
+    The context gets its own db.session, so ORM objects must not escape it;
+    fn should return plain data such as to_dict() output.
+    """
+    return _run_in_tenant(current_app._get_current_object(), tenant_id, fn, args, kwargs)
+
+
+def _run_in_tenant(app, tenant_id, fn, args, kwargs):
+    with app.app_context():
+        g.tenant_id = tenant_id
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            app.extensions['sqlalchemy'].session.remove()
+
+
+def fan_out(tenant_ids, fn, *args, **kwargs):
+    """Run fn against every tenant in parallel and return {tenant_id: result}"""
+    tenant_ids = list(tenant_ids)
+    if not tenant_ids:
+        return {}
+
+    app = current_app._get_current_object()
+    max_workers = min(len(tenant_ids), app.config.get('TENANT_FANOUT_WORKERS', 8))
+
+    def call(tenant_id):
+        return _run_in_tenant(app, tenant_id, fn, args, kwargs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(call, tenant_ids)
+        return dict(zip(tenant_ids, results))
@@ -1,10 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from src.models.tenant import TenantSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': TenantSession})
 
 class User(db.Model):
+    # Never reuse ids: sessions identify users by id
+    __table_args__ = {'sqlite_autoincrement': True}
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=True)
@@ -49,7 +53,24 @@ class User(db.Model):
             'admin_id': self.admin_id
         }
 
+class LoginIndex(db.Model):
+    # Directory-only map of every login identifier (username, email or phone)
+    # to the database holding its user; tenant_id None means the directory.
+    # user_id is None while an identifier is reserved for a user being created.
+    __table_args__ = {'info': {'directory': True}}
+
+    login = db.Column(db.String(120), primary_key=True)
+    tenant_id = db.Column(db.Integer, nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+
+    def __repr__(self):
+        return f'<LoginIndex {self.login} -> {self.tenant_id}/{self.user_id}>'
+
 class AttendanceRecord(db.Model):
+    # One record per user per day; databases created before this index get
+    # it from ensure_unique_attendance() at startup
+    __table_args__ = (db.Index('uq_attendance_user_date', 'user_id', 'date', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
@@ -1,11 +1,31 @@
-from flask import Blueprint, jsonify, request, session
+from flask import Blueprint, jsonify, request, session, g, current_app
 from src.models.user import User, AttendanceRecord, ExtraPayment, WeeklyReport, db
+from src.models.tenant import run_in_tenant, fan_out
+from src.models.directory import (
+    tenant_ids, login_identifiers, find_login, reserve_logins, assign_logins,
+    release_logins, provision_tenant
+)
+from src.models.attendance_batch import submit_mark
 from datetime import datetime, date, timedelta
 from functools import wraps
 import calendar
 
 user_bp = Blueprint('user', __name__)
 
+@user_bp.before_request
+def bind_tenant():
+    # Sessions bound to the directory must log in again once their user has
+    # been moved to a tenant database (or predate sharding altogether). The
+    # username check stops a stale session from matching a newer user that
+    # was given the same id.
+    if 'user_id' in session and session.get('tenant_id') is None:
+        user = User.query.get(session['user_id']) if 'tenant_id' in session else None
+        if not user or user.username != session.get('username'):
+            session.clear()
+    
+    # Route this request's queries to the logged-in user's tenant database
+    g.tenant_id = session.get('tenant_id')
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -25,37 +45,53 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Tenant helpers
+def _authenticate(user_id, password):
+    user = db.session.get(User, user_id)
+    if user and user.check_password(password):
+        return user.to_dict()
+    return None
+
 # Authentication endpoints
 @user_bp.route('/register', methods=['POST'])
 def register():
     data = request.json
     
-    # Check if user already exists
-    existing_user = User.query.filter(
-        (User.username == data['username']) |
-        (User.email == data.get('email')) |
-        (User.phone == data.get('phone'))
-    ).first()
+    # Admins live in the directory; workers go to their admin's tenant
+    tenant_id = None
+    if data.get('role', 'worker') == 'worker' and data.get('admin_id') in tenant_ids():
+        tenant_id = data['admin_id']
+        provision_tenant(tenant_id)
     
-    if existing_user:
+    # Claiming the login identifiers fails if any user already has them
+    logins = login_identifiers(data['username'], data.get('email'), data.get('phone'))
+    if not reserve_logins(logins, tenant_id):
         return jsonify({'error': 'User already exists'}), 400
     
-    # Create new user
-    user = User(
-        username=data['username'],
-        email=data.get('email'),
-        phone=data.get('phone'),
-        role=data.get('role', 'worker'),
-        daily_wage=data.get('daily_wage'),
-        standard_hours=data.get('standard_hours', 8.0),
-        admin_id=data.get('admin_id')
-    )
-    user.set_password(data['password'])
-    
-    db.session.add(user)
-    db.session.commit()
-    
-    return jsonify(user.to_dict()), 201
+    def create_user():
+        user = User(
+            username=data['username'],
+            email=data.get('email'),
+            phone=data.get('phone'),
+            role=data.get('role', 'worker'),
+            daily_wage=data.get('daily_wage'),
+            standard_hours=data.get('standard_hours', 8.0),
+            admin_id=data.get('admin_id')
+        )
+        user.set_password(data['password'])
+        
+        db.session.add(user)
+        db.session.commit()
+        return user.to_dict()
+    
+    try:
+        user = run_in_tenant(tenant_id, create_user)
+    except Exception:
+        release_logins(logins)
+        raise
+    assign_logins(logins, tenant_id, user['id'])
+    
+    return jsonify(user), 201
 
 @user_bp.route('/login', methods=['POST'])
 def login():
@@ -63,19 +99,25 @@ def login():
     login_field = data.get('login')  # Can be username, email, or phone
     password = data.get('password')
     
-    # Find user by username, email, or phone
-    user = User.query.filter(
-        (User.username == login_field) |
-        (User.email == login_field) |
-        (User.phone == login_field)
-    ).first()
-    
-    if user and user.check_password(password):
-        session['user_id'] = user.id
-        session['user_role'] = user.role
+    # Find user by username, email, or phone through the directory's login
+    # index, then check the password in the database that holds the user
+    tenant_id, user = None, None
+    entry = find_login(login_field)
+    if entry:
+        tenant_id, user_id = entry
+        user = run_in_tenant(tenant_id, _authenticate, user_id, password)
+    if user and user['role'] == 'admin':
+        tenant_id = user['id']
+        provision_tenant(tenant_id)
+    
+    if user:
+        session['user_id'] = user['id']
+        session['username'] = user['username']
+        session['user_role'] = user['role']
+        session['tenant_id'] = tenant_id
         return jsonify({
             'message': 'Login successful',
-            'user': user.to_dict()
+            'user': user
         })
     
     return jsonify({'error': 'Invalid credentials'}), 401
@@ -106,14 +148,9 @@ def create_worker():
     data = request.json
     admin_id = session['user_id']
     
-    # Check if worker already exists
-    existing_user = User.query.filter(
-        (User.username == data['username']) |
-        (User.email == data.get('email')) |
-        (User.phone == data.get('phone'))
-    ).first()
-    
-    if existing_user:
+    # Claiming the login identifiers fails if any user already has them
+    logins = login_identifiers(data['username'], data.get('email'), data.get('phone'))
+    if not reserve_logins(logins, g.tenant_id):
         return jsonify({'error': 'Worker already exists'}), 400
     
     # Create new worker
@@ -128,8 +165,13 @@ def create_worker():
     )
     worker.set_password(data['password'])
     
-    db.session.add(worker)
-    db.session.commit()
+    try:
+        db.session.add(worker)
+        db.session.commit()
+    except Exception:
+        release_logins(logins)
+        raise
+    assign_logins(logins, g.tenant_id, worker.id)
     
     return jsonify(worker.to_dict()), 201
 
@@ -143,6 +185,18 @@ def update_worker(worker_id):
         return jsonify({'error': 'Worker not found'}), 404
     
     data = request.json
+    
+    # Usernames, emails and phones must stay unique across all tenants:
+    # claim the new identifiers first and release the old ones afterwards
+    old_logins = login_identifiers(worker.username, worker.email, worker.phone)
+    new_logins = login_identifiers(data.get('username', worker.username),
+                                   data.get('email', worker.email),
+                                   data.get('phone', worker.phone))
+    added = [l for l in new_logins if l not in old_logins]
+    removed = [l for l in old_logins if l not in new_logins]
+    if added and not reserve_logins(added, g.tenant_id):
+        return jsonify({'error': 'Worker already exists'}), 400
+    
     worker.username = data.get('username', worker.username)
     worker.email = data.get('email', worker.email)
     worker.phone = data.get('phone', worker.phone)
@@ -153,7 +207,13 @@ def update_worker(worker_id):
     if 'password' in data:
         worker.set_password(data['password'])
     
-    db.session.commit()
+    try:
+        db.session.commit()
+    except Exception:
+        release_logins(added)
+        raise
+    assign_logins(added, g.tenant_id, worker.id)
+    release_logins(removed)
     return jsonify(worker.to_dict())
 
 @user_bp.route('/workers/<int:worker_id>', methods=['DELETE'])
@@ -165,78 +225,39 @@ def delete_worker(worker_id):
     if not worker:
         return jsonify({'error': 'Worker not found'}), 404
     
+    logins = login_identifiers(worker.username, worker.email, worker.phone)
     db.session.delete(worker)
     db.session.commit()
+    release_logins(logins)
     return '', 204
 
 # Attendance endpoints
 @user_bp.route('/attendance/mark-entry', methods=['POST'])
 @login_required
 def mark_entry():
-    user_id = session['user_id']
-    today = date.today()
+    # Create or update today's record; concurrent marks share one commit
+    mark = submit_mark('entry', session['user_id'])
     
-    # Check if entry already marked today
-    existing_record = AttendanceRecord.query.filter_by(
-        user_id=user_id, 
-        date=today
-    ).first()
-    
-    if existing_record and existing_record.entry_time:
-        return jsonify({'error': 'Entry already marked for today'}), 400
+    if mark.error:
+        return jsonify({'error': mark.error}), 400
     
-    # Create or update attendance record
-    if existing_record:
-        existing_record.entry_time = datetime.now()
-    else:
-        record = AttendanceRecord(
-            user_id=user_id,
-            date=today,
-            entry_time=datetime.now()
-        )
-        db.session.add(record)
-    
-    db.session.commit()
-    
-    record = AttendanceRecord.query.filter_by(user_id=user_id, date=today).first()
     return jsonify({
         'message': 'Entry marked successfully',
-        'record': record.to_dict()
+        'record': mark.record
     })
 
 @user_bp.route('/attendance/mark-exit', methods=['POST'])
 @login_required
 def mark_exit():
-    user_id = session['user_id']
-    today = date.today()
-    
-    # Get today's attendance record
-    record = AttendanceRecord.query.filter_by(
-        user_id=user_id, 
-        date=today
-    ).first()
+    # Mark exit, calculate hours and earnings; concurrent marks share one commit
+    mark = submit_mark('exit', session['user_id'])
     
-    if not record or not record.entry_time:
-        return jsonify({'error': 'Please mark entry first'}), 400
-    
-    if record.exit_time:
-        return jsonify({'error': 'Exit already marked for today'}), 400
-    
-    # Mark exit and calculate hours
-    record.exit_time = datetime.now()
-    
-    # Calculate total hours
-    time_diff = record.exit_time - record.entry_time
-    record.total_hours = round(time_diff.total_seconds() / 3600, 2)
-    
-    # Calculate earnings
-    record.calculate_earnings()
-    
-    db.session.commit()
+    if mark.error:
+        return jsonify({'error': mark.error}), 400
     
     return jsonify({
         'message': 'Exit marked successfully',
-        'record': record.to_dict()
+        'record': mark.record
     })
 
 @user_bp.route('/attendance/today', methods=['GET'])
@@ -325,6 +346,57 @@ def admin_dashboard():
         'workers': [w.to_dict() for w in workers]
     })
 
+def _site_summary(admin_id, start, end):
+    workers = User.query.filter_by(admin_id=admin_id, role='worker').all()
+    records = AttendanceRecord.query.filter(
+        AttendanceRecord.user_id.in_([w.id for w in workers]),
+        AttendanceRecord.date >= start,
+        AttendanceRecord.date <= end
+    ).all()
+    payments = ExtraPayment.query.filter(
+        ExtraPayment.user_id.in_([w.id for w in workers]),
+        ExtraPayment.date >= start,
+        ExtraPayment.date <= end
+    ).all()
+    
+    return {
+        'admin_id': admin_id,
+        'total_workers': len(workers),
+        'total_days': len(records),
+        'total_hours': sum([r.total_hours or 0 for r in records]),
+        'total_earnings': sum([r.daily_earning or 0 for r in records]),
+        'extra_payments': sum([p.amount for p in payments])
+    }
+
+@user_bp.route('/admin/sites/summary', methods=['GET'])
+@admin_required
+def get_sites_summary():
+    # Cross-tenant report: query the admin databases in parallel. Only admins
+    # listed in REPORTING_ADMIN_IDS see every site; others see their own.
+    admin_id = session['user_id']
+    today = date.today()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    start = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else today.replace(day=1)
+    end = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else today
+    
+    if admin_id in current_app.config.get('REPORTING_ADMIN_IDS', []):
+        site_ids = tenant_ids()
+    else:
+        site_ids = [admin_id]
+    summaries = fan_out(site_ids, lambda: _site_summary(g.tenant_id, start, end))
+    sites = [summaries[t] for t in site_ids]
+    
+    return jsonify({
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'sites': sites,
+        'total_workers': sum([s['total_workers'] for s in sites]),
+        'total_hours': sum([s['total_hours'] for s in sites]),
+        'total_earnings': sum([s['total_earnings'] for s in sites]),
+        'extra_payments': sum([s['extra_payments'] for s in sites])
+    })
+
 @user_bp.route('/admin/workers/<int:worker_id>/attendance', methods=['GET'])
 @admin_required
 def get_worker_attendance(worker_id):
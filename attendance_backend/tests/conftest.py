@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from src.models.directory import sync_login_index
+from src.models.user import User, db
+from src.routes.user import user_bp
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'app.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TENANT_DATABASE_URI'] = f"sqlite:///{tmp_path / 'tenants' / 'tenant_{tenant_id}.db'}"
+    app.config['ATTENDANCE_BATCHING'] = False
+    app.register_blueprint(user_bp, url_prefix='/api')
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        admin = User(username='admin', role='admin')
+        admin.set_password('pw')
+        db.session.add(admin)
+        db.session.commit()
+        sync_login_index()
+    return app
+
+
+@pytest.fixture
+def login(app):
+    def login(username, password='pw'):
+        client = app.test_client()
+        response = client.post('/api/login', json={'login': username, 'password': password})
+        assert response.status_code == 200
+        return client
+    return login
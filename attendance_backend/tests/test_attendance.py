@@ -0,0 +1,81 @@
+import threading
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from src.models.attendance_batch import ensure_unique_attendance, submit_mark
+from src.models.directory import sync_login_index
+from src.models.tenant import run_in_tenant
+from src.models.user import User, AttendanceRecord, db
+
+
+def add_duplicate_days(app):
+    # A directory from before the unique index, holding duplicate records
+    with app.app_context():
+        db.session.execute(text('DROP INDEX uq_attendance_user_date'))
+        worker = User(username='w', role='worker', daily_wage=800.0, admin_id=1)
+        worker.set_password('pw')
+        db.session.add(worker)
+        db.session.flush()
+        day = date(2026, 10, 1)
+        db.session.add_all([
+            AttendanceRecord(user_id=worker.id, date=day, entry_time=datetime(2026, 10, 1, 9), notes='first'),
+            AttendanceRecord(user_id=worker.id, date=day, entry_time=datetime(2026, 10, 1, 9, 5),
+                             exit_time=datetime(2026, 10, 1, 17), total_hours=7.92)
+        ])
+        db.session.commit()
+        sync_login_index()
+        return worker.id
+
+
+def test_move_merges_duplicate_days(app, login):
+    add_duplicate_days(app)
+
+    login('admin')
+
+    with app.app_context():
+        assert AttendanceRecord.query.count() == 0
+        records = run_in_tenant(1, lambda: [r.to_dict() for r in AttendanceRecord.query.all()])
+    assert len(records) == 1
+    assert records[0]['total_hours'] == 7.92
+    assert records[0]['notes'] == 'first'
+
+
+def test_ensure_unique_attendance_merges_and_adds_index(app):
+    worker_id = add_duplicate_days(app)
+
+    with app.app_context():
+        ensure_unique_attendance()
+        assert AttendanceRecord.query.count() == 1
+
+        db.session.add(AttendanceRecord(user_id=worker_id, date=date(2026, 10, 1)))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+
+
+def test_missing_user_does_not_fail_batch(app):
+    app.config['ATTENDANCE_BATCHING'] = True
+    app.config['ATTENDANCE_BATCH_WINDOW_MS'] = 50
+    with app.app_context():
+        worker = User(username='w', role='worker', daily_wage=800.0, password_hash='-')
+        db.session.add(worker)
+        db.session.commit()
+        worker_id = worker.id
+
+    results = {}
+
+    def mark(user_id):
+        with app.app_context():
+            results[user_id] = submit_mark('entry', user_id)
+
+    threads = [threading.Thread(target=mark, args=(user_id,)) for user_id in (worker_id, 999)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results[worker_id].error is None
+    assert results[worker_id].record['user_id'] == worker_id
+    assert results[999].error == 'User not found'
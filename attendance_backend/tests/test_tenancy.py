@@ -0,0 +1,97 @@
+from datetime import date, datetime
+
+from src.models.directory import sync_login_index
+from src.models.tenant import run_in_tenant
+from src.models.user import User, AttendanceRecord, db
+
+
+def add_directory_worker(app, username, admin_id=1):
+    # A worker created before sharding, still in the directory database
+    with app.app_context():
+        worker = User(username=username, role='worker', daily_wage=800.0, admin_id=admin_id)
+        worker.set_password('pw')
+        db.session.add(worker)
+        db.session.commit()
+        sync_login_index()
+        return worker.id
+
+
+def tenant_workers(app, admin_id):
+    with app.app_context():
+        return run_in_tenant(admin_id, lambda: sorted(
+            (u.username, len(u.attendance_records))
+            for u in User.query.filter_by(role='worker').all()
+        ))
+
+
+def test_stale_directory_session_rejected_after_id_reuse(app, login):
+    worker_id = add_directory_worker(app, 'w')
+    worker = login('w')
+
+    # The admin's login moves the worker out of the directory
+    login('admin')
+
+    # A new directory user takes the freed id (as in databases created
+    # without AUTOINCREMENT)
+    with app.app_context():
+        db.session.add(User(id=worker_id, username='boss2', role='admin', password_hash='-'))
+        db.session.commit()
+
+    assert worker.get('/api/workers').status_code == 401
+    assert worker.get('/api/profile').status_code == 401
+
+
+def test_user_ids_not_reused(app):
+    worker_id = add_directory_worker(app, 'w')
+    with app.app_context():
+        db.session.delete(db.session.get(User, worker_id))
+        db.session.commit()
+
+    response = app.test_client().post('/api/register', json={
+        'username': 'boss2', 'password': 'pw', 'role': 'admin'
+    })
+    assert response.status_code == 201
+    assert response.get_json()['id'] != worker_id
+
+
+def test_move_finishes_leftover_directory_rows(app, login):
+    worker_id = add_directory_worker(app, 'w')
+    with app.app_context():
+        db.session.add(AttendanceRecord(user_id=worker_id, date=date(2026, 10, 1), entry_time=datetime(2026, 10, 1, 9)))
+        db.session.commit()
+
+    login('admin')
+    assert tenant_workers(app, 1) == [('w', 1)]
+
+    # Directory rows left behind by an interrupted move, plus a mark
+    # written to the directory after the copy
+    with app.app_context():
+        db.session.add(User(id=worker_id, username='w', role='worker', admin_id=1, password_hash='-'))
+        db.session.add(AttendanceRecord(user_id=worker_id, date=date(2026, 10, 1), entry_time=datetime(2026, 10, 1, 9)))
+        db.session.add(AttendanceRecord(user_id=worker_id, date=date(2026, 10, 2), entry_time=datetime(2026, 10, 2, 9)))
+        db.session.commit()
+
+    login('admin')
+    assert tenant_workers(app, 1) == [('w', 2)]
+    with app.app_context():
+        assert User.query.filter_by(role='worker').count() == 0
+        assert AttendanceRecord.query.count() == 0
+
+    worker = login('w')
+    assert worker.get('/api/attendance/history').get_json()['total'] == 2
+
+
+def test_login_identifiers_unique_across_tenants(app, login):
+    client = app.test_client()
+    client.post('/api/register', json={'username': 'admin2', 'password': 'pw', 'role': 'admin'})
+    admin1, admin2 = login('admin'), login('admin2')
+
+    assert admin1.post('/api/workers', json={'username': 'w', 'password': 'pw', 'daily_wage': 800}).status_code == 201
+    assert admin2.post('/api/workers', json={'username': 'w', 'password': 'pw', 'daily_wage': 800}).status_code == 400
+
+    other = admin2.post('/api/workers', json={'username': 'v', 'password': 'pw', 'daily_wage': 800}).get_json()
+    assert admin2.put(f"/api/workers/{other['id']}", json={'username': 'w'}).status_code == 400
+    assert admin2.put(f"/api/workers/{other['id']}", json={'username': 'v2'}).status_code == 200
+
+    assert login('w').get('/api/profile').get_json()['admin_id'] == 1
+    assert login('v2').get('/api/profile').get_json()['admin_id'] == 2